@@ -1,17 +1,96 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from fastapi import FastAPI, File, UploadFile, Request
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from fastapi.responses import HTMLResponse, JSONResponse
+from starlette.concurrency import run_in_threadpool
 from pathlib import Path
+from typing import Dict, Optional, Tuple
+from collections import OrderedDict
+import hashlib
 import io
+import os
 from docx import Document
-import PyPDF2
+import fitz
 import traceback
-from .ml_model.grading_model import AIGrader
+import torch
+from .ml_model.grading_model import AIGrader, GRADER_FINGERPRINT
+
+# Server worker processes, read the same way uvicorn picks its default --workers
+# (1 when WEB_CONCURRENCY is unset). Set WEB_CONCURRENCY rather than --workers so
+# each worker can size its torch thread pool to its share of the cores.
+WORKERS = max(1, int(os.environ.get("WEB_CONCURRENCY", "1")))
+
+# Per-file upload limit (5MB)
+MAX_FILE_SIZE = 5 * 1024 * 1024
+
+# Two files plus multipart framing; larger request bodies are rejected outright
+MAX_REQUEST_SIZE = 2 * MAX_FILE_SIZE + 64 * 1024
+
+class RequestSizeLimitMiddleware:
+    """
+    Rejects request bodies over max_size with a 413. Content-Length is checked
+    up front, and bytes are counted as they arrive so chunked uploads are
+    stopped too, before the multipart parser spools the whole body.
+    """
+
+    def __init__(self, app, max_size: int):
+        self.app = app
+        self.max_size = max_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        response = JSONResponse(
+            status_code=413,
+            content={"error": "Upload too large. Please keep files under 5MB."}
+        )
+        content_length = dict(scope["headers"]).get(b"content-length", b"")
+        if content_length.isdigit() and int(content_length) > self.max_size:
+            await response(scope, receive, send)
+            return
+
+        received = 0
+        response_started = False
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_size and not response_started:
+                    # Answer now and make the app see a disconnect so it stops reading
+                    rejected = True
+                    await response(scope, receive, send)
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            if rejected:
+                return
+            if message["type"] == "http.response.start":
+                response_started = True
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            # The app failing on the forced disconnect is expected once we've answered
+            if not rejected:
+                raise
 
 app = FastAPI()
 
+# Registered before CORS so its 413 responses still carry CORS headers
+app.add_middleware(RequestSizeLimitMiddleware, max_size=MAX_REQUEST_SIZE)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -21,6 +100,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress detailed feedback responses on the wire
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+# Analysis results for recently seen (rubric, assignment) pairs, keyed by text hashes
+RESULT_CACHE_SIZE = 256
+_result_cache: 'OrderedDict[Tuple[bytes, bytes], Dict]' = OrderedDict()
+
 # Get the current directory
 BASE_DIR = Path(__file__).resolve().parent
 
@@ -30,12 +118,29 @@ app.mount("/static", StaticFiles(directory=str(BASE_DIR / "static")), name="stat
 # Setup templates
 templates = Jinja2Templates(directory=str(BASE_DIR / "templates"))
 
+@app.on_event("startup")
+def load_grader():
+    """Load the grading model once and share it across requests."""
+    print("Initializing grader...")
+    # Each worker holds its own model, so split the cores between them
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // WORKERS))
+    app.state.grader = AIGrader(
+        half_precision=os.environ.get("GRADER_HALF_PRECISION") == "1",
+        compile_model=os.environ.get("GRADER_COMPILE") == "1",
+        cuda_graphs=os.environ.get("GRADER_CUDA_GRAPHS") == "1",
+    )
+
 def process_document(content: bytes, filename: str) -> str:
     """Convert document content to text based on file type."""
     try:
         if filename.endswith('.pdf'):
-            pdf_reader = PyPDF2.PdfReader(io.BytesIO(content))
-            return ' '.join(page.extract_text() for page in pdf_reader.pages)
+            parts = []
+            with fitz.open(stream=content, filetype="pdf") as pdf:
+                for page in pdf:
+                    text = page.get_text("text")
+                    if text:
+                        parts.append(text)
+            return ' '.join(parts)
         elif filename.endswith('.docx'):
             doc = Document(io.BytesIO(content))
             return ' '.join(paragraph.text for paragraph in doc.paragraphs)
@@ -45,6 +150,18 @@ def process_document(content: bytes, filename: str) -> str:
         print(f"Error processing {filename}: {str(e)}")
         raise Exception(f"Could not process {filename}. Make sure it's a valid PDF or DOCX file.")
 
+async def read_capped(upload: UploadFile, limit: int) -> Optional[bytes]:
+    """Read an upload in chunks, returning None as soon as it exceeds limit bytes."""
+    buf = bytearray()
+    while True:
+        chunk = await upload.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        buf.extend(chunk)
+        if len(buf) > limit:
+            return None
+    return bytes(buf)
+
 @app.get("/", response_class=HTMLResponse)
 async def read_root(request: Request):
     return templates.TemplateResponse(
@@ -54,45 +171,62 @@ async def read_root(request: Request):
 
 @app.post("/analyze")
 async def analyze_assignment(
+    request: Request,
     rubric: UploadFile = File(...),
     assignment: UploadFile = File(...)
 ):
-    # Add file size check (5MB limit)
-    MAX_FILE_SIZE = 5 * 1024 * 1024
-    
     try:
         print(f"Received files: {rubric.filename}, {assignment.filename}")
         
         # Check and read rubric
         print("Reading rubric file...")
-        rubric_content = await rubric.read()
-        if len(rubric_content) > MAX_FILE_SIZE:
+        rubric_content = await read_capped(rubric, MAX_FILE_SIZE)
+        if rubric_content is None:
             return JSONResponse(
-                status_code=400,
+                status_code=413,
                 content={"error": "Rubric file too large. Please keep files under 5MB."}
             )
             
         # Check and read assignment
         print("Reading assignment file...")
-        assignment_content = await assignment.read()
-        if len(assignment_content) > MAX_FILE_SIZE:
+        assignment_content = await read_capped(assignment, MAX_FILE_SIZE)
+        if assignment_content is None:
             return JSONResponse(
-                status_code=400,
+                status_code=413,
                 content={"error": "Assignment file too large. Please keep files under 5MB."}
             )
 
         print("Converting files to text...")
-        rubric_text = process_document(rubric_content, rubric.filename)
-        assignment_text = process_document(assignment_content, assignment.filename)
+        rubric_text = await run_in_threadpool(process_document, rubric_content, rubric.filename)
+        assignment_text = await run_in_threadpool(process_document, assignment_content, assignment.filename)
 
-        print("Initializing grader...")
-        grader = AIGrader()
-        
-        print("Starting analysis...")
-        results = grader.analyze_rubric_and_assignment(rubric_text, assignment_text)
+        cache_key = (
+            hashlib.blake2b(rubric_text.encode('utf-8')).digest(),
+            hashlib.blake2b(assignment_text.encode('utf-8')).digest(),
+        )
+        # Weak tag: the grader configuration is part of it, and gzip may change the bytes
+        etag_digest = hashlib.blake2b(
+            GRADER_FINGERPRINT.encode('utf-8') + b''.join(cache_key), digest_size=16
+        ).hexdigest()
+        etag = f'W/"{etag_digest}"'
+
+        results = _result_cache.get(cache_key)
+        if results is not None:
+            print("Returning cached analysis")
+            _result_cache.move_to_end(cache_key)
+        else:
+            grader = request.app.state.grader
+
+            print("Starting analysis...")
+            results = await run_in_threadpool(
+                grader.analyze_rubric_and_assignment, rubric_text, assignment_text
+            )
+            _result_cache[cache_key] = results
+            while len(_result_cache) > RESULT_CACHE_SIZE:
+                _result_cache.popitem(last=False)
 
         print("Analysis complete")
-        return JSONResponse(content=results)
+        return JSONResponse(content=results, headers={"ETag": etag})
 
     except Exception as e:
         error_msg = f"Error during analysis: {str(e)}"
@@ -105,4 +239,9 @@ async def analyze_assignment(
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    uvicorn.run(
+        "app.main:app",
+        host="0.0.0.0",
+        port=8000,
+        workers=WORKERS,
+    )
\ No newline at end of file
@@ -1,4 +1,9 @@
 # app/ml_model/__init__.py
-from .grading_model import AIGrader
+# The grader pulls in torch and transformers, so import it only on first use
+def __getattr__(name):
+    if name == 'AIGrader':
+        from .grading_model import AIGrader
+        return AIGrader
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 __all__ = ['AIGrader']
\ No newline at end of file
@@ -1,14 +1,126 @@
 # app/ml_model/grading_model.py
 from transformers import AutoTokenizer, AutoModel
 import torch
-from typing import List, Dict
+from typing import List, Dict, Optional, Set
 import re
 import numpy as np
+import ahocorasick
+from collections import OrderedDict
+import hashlib
+import threading
+
+# Small sentence encoder; mean-pooled embeddings are used for similarity
+MODEL_NAME = 'sentence-transformers/all-MiniLM-L6-v2'
+
+# all-MiniLM-L6-v2 was trained on inputs of at most 256 tokens
+MODEL_MAX_LENGTH = 256
+
+# MiniLM cosine similarities run much lower than raw BERT's: a requirement and
+# a passage that addresses it typically score 0.5-0.7, unrelated text 0.0-0.2
+SIMILARITY_MET_THRESHOLD = 0.55
+SIMILARITY_PARTIAL_THRESHOLD = 0.35
+
+# Maximum number of requirement embeddings kept in memory across requests
+EMBEDDING_CACHE_SIZE = 4096
+
+# Recent assignments whose chunk embeddings are kept for repeat grading
+ASSIGNMENT_CACHE_SIZE = 32
+
+# Assignments longer than one model window are split into overlapping chunks
+CHUNK_MAX_LENGTH = MODEL_MAX_LENGTH
+CHUNK_STRIDE = 64
+
+# At most this many windows (~48k tokens) are embedded per assignment; text past
+# the cap is ignored for similarity but still counts for keyword matching
+MAX_ASSIGNMENT_CHUNKS = 256
+
+# Text is cut to this many characters before tokenizing so huge uploads don't
+# build thousands of windows only to discard them. At a generous 6 characters
+# per token this still covers more than MAX_ASSIGNMENT_CHUNKS windows.
+MAX_ASSIGNMENT_CHARS = MAX_ASSIGNMENT_CHUNKS * (CHUNK_MAX_LENGTH - CHUNK_STRIDE) * 6
+
+# Larger requirement batches are length-sorted and split to limit padding
+EMBED_BATCH_SIZE = 64
+
+# Sequence-length buckets for captured CUDA graphs; batch sizes round up to powers of two
+CUDA_GRAPH_SEQ_BUCKETS = (64, 128, MODEL_MAX_LENGTH)
+
+# Keyword coverage at or above this is treated as Met without running the model
+KEYWORD_MET_THRESHOLD = 0.9
+
+# Assignments shorter than this with no keyword hits are Not Met without the model
+SHORT_ASSIGNMENT_WORDS = 200
+
+# Identifies every setting that can change a grade, so response ETags change with it
+GRADER_FINGERPRINT = '|'.join(str(v) for v in (
+    MODEL_NAME, MODEL_MAX_LENGTH, CHUNK_STRIDE, MAX_ASSIGNMENT_CHUNKS,
+    SIMILARITY_MET_THRESHOLD, SIMILARITY_PARTIAL_THRESHOLD,
+    KEYWORD_MET_THRESHOLD, SHORT_ASSIGNMENT_WORDS
+))
+
+# Regexes are compiled once at import instead of on every rubric section
+_POINT_RES = [re.compile(p, re.IGNORECASE) for p in (
+    r'(\d+)\s*points?',
+    r'(\d+)\s*marks?',
+    r'worth\s*(\d+)',
+    r'value:\s*(\d+)',
+    r'points:\s*(\d+)'
+)]
+
+# All requirement indicators fused so each section is scanned once
+_REQ_RE = re.compile(
+    r'(?:must|should|needs?\s+to|required\s+to|demonstrate|explain|analyze|discuss)\s+(.*?)[.]',
+    re.IGNORECASE
+)
+
+# One alternation per requirement type, checked in order
+_REQ_TYPE_RES = [
+    ('analysis', re.compile(r'analyze|examine|evaluate|assess', re.IGNORECASE)),
+    ('implementation', re.compile(r'implement|create|develop|build', re.IGNORECASE)),
+    ('understanding', re.compile(r'understand|explain|describe|discuss', re.IGNORECASE)),
+    ('demonstration', re.compile(r'demonstrate|show|display|present', re.IGNORECASE))
+]
 
 class AIGrader:
-    def __init__(self):
-        self.tokenizer = AutoTokenizer.from_pretrained('bert-base-uncased')
-        self.model = AutoModel.from_pretrained('bert-base-uncased')
+    def __init__(self, half_precision: bool = False, compile_model: bool = False,
+                 cuda_graphs: bool = False):
+        """
+        half_precision loads the model in bfloat16 on CPU / float16 on GPU,
+        and compile_model wraps it with torch.compile. Both are opt-in since
+        they need a recent PyTorch and hardware support to pay off.
+        cuda_graphs captures a forward per (batch, length) bucket on GPU at
+        construction and replays it per request; it is ignored on CPU and
+        when compile_model already does so.
+        """
+        self.device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+        if half_precision:
+            dtype = torch.bfloat16 if self.device.type == 'cpu' else torch.float16
+        else:
+            dtype = torch.float32
+
+        self.tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, use_fast=True)
+        if not self.tokenizer.is_fast:
+            # Assignment chunking relies on overflowing tokens from the Rust tokenizer
+            raise RuntimeError(f"A fast tokenizer is required for {MODEL_NAME}; install `tokenizers`.")
+        # The Rust tokenizer mutates its truncation settings per call, which
+        # conflicts with concurrent encodes from other request threads
+        self._tokenizer_lock = threading.Lock()
+        self.model = AutoModel.from_pretrained(MODEL_NAME, torch_dtype=dtype)
+        self.model.to(self.device)
+        self.model.eval()
+        compiled = compile_model and hasattr(torch, 'compile')
+        if compiled:
+            self.model = torch.compile(self.model, mode='reduce-overhead')
+        self._use_cuda_graphs = cuda_graphs and self.device.type == 'cuda' and not compiled
+        self._cuda_graphs: Dict[tuple, tuple] = {}
+        # Captured graphs share static input/output buffers between threads
+        self._cuda_graph_lock = threading.Lock()
+        if self._use_cuda_graphs:
+            self._capture_cuda_graphs()
+        self._emb_cache: 'OrderedDict[str, torch.Tensor]' = OrderedDict()
+        # Requests are graded on worker threads, so guard the shared caches
+        self._emb_cache_lock = threading.Lock()
+        self._chunk_cache: 'OrderedDict[bytes, torch.Tensor]' = OrderedDict()
 
     def analyze_rubric_and_assignment(self, rubric_text: str, assignment_text: str) -> Dict:
         """Main method to analyze assignment against rubric."""
@@ -48,37 +160,58 @@ class AIGrader:
         """
         Grades assignment based on extracted criteria using semantic similarity.
         """
-        results = []
-        total_points = sum(c['points'] for c in criteria)
-        earned_points = 0
-        
-        for criterion in criteria:
-            # Get embeddings for requirement and assignment
-            req_embedding = self._get_text_embedding(criterion['requirement'])
-            assign_embedding = self._get_text_embedding(assignment_text)
-            
-            # Calculate similarity score
-            similarity = self._calculate_similarity(req_embedding, assign_embedding)
-            
-            # Check for specific requirements
-            requirement_met = self._check_requirement_fulfillment(
-                criterion,
-                assignment_text,
-                similarity
+        # Locate every rubric keyword in one pass over the assignment
+        found_keywords = self._find_keywords(criteria, assignment_text)
+        presences = [self._keyword_presence(c, found_keywords) for c in criteria]
+
+        # Only run the model for criteria keyword coverage can't decide
+        short_assignment = len(assignment_text.split()) < SHORT_ASSIGNMENT_WORDS
+        keyword_levels = [
+            self._keyword_level(c, presence, short_assignment)
+            for c, presence in zip(criteria, presences)
+        ]
+        similarities: List[Optional[float]] = [None] * len(criteria)
+        undecided = [i for i, level in enumerate(keyword_levels) if level is None]
+        if undecided:
+            # Compare each requirement against its best-matching assignment chunk
+            chunk_embeddings = self._get_assignment_embeddings(assignment_text)
+            req_embeddings = self._get_requirement_embeddings(
+                [criteria[i]['requirement'] for i in undecided]
             )
-            
-            # Calculate points
-            points_earned = criterion['points'] * requirement_met['score']
-            earned_points += points_earned
-            
-            results.append({
+            # Normalized matmul gives the R x C cosine matrix without an R x C x H intermediate
+            scores = (
+                torch.nn.functional.normalize(req_embeddings, dim=-1)
+                @ torch.nn.functional.normalize(chunk_embeddings, dim=-1).T
+            ).max(dim=1).values
+            for i, similarity in zip(undecided, scores.tolist()):
+                similarities[i] = similarity
+
+        # Check for specific requirements
+        fulfillments = [
+            self._check_requirement_fulfillment(criterion, presence, similarity, keyword_level)
+            for criterion, presence, similarity, keyword_level in zip(
+                criteria, presences, similarities, keyword_levels
+            )
+        ]
+
+        # Tally points for all criteria at once
+        points_arr = np.fromiter((c['points'] for c in criteria), dtype=np.float64, count=len(criteria))
+        score_arr = np.fromiter((f['score'] for f in fulfillments), dtype=np.float64, count=len(criteria))
+        earned_arr = points_arr * score_arr
+        total_points = int(points_arr.sum())
+        earned_points = float(earned_arr.sum())
+
+        results = [
+            {
                 'requirement': criterion['requirement'],
                 'points_possible': criterion['points'],
-                'points_earned': round(points_earned),
-                'fulfillment_level': requirement_met['level'],
-                'feedback': requirement_met['feedback'],
-                'improvement_suggestions': requirement_met['suggestions']
-            })
+                'points_earned': int(round(earned)),
+                'fulfillment_level': fulfillment['level'],
+                'feedback': fulfillment['feedback'],
+                'improvement_suggestions': fulfillment['suggestions']
+            }
+            for criterion, fulfillment, earned in zip(criteria, fulfillments, earned_arr.tolist())
+        ]
         
         return {
             'score': round((earned_points / total_points) * 100, 1) if total_points > 0 else 0,
@@ -89,30 +222,162 @@ class AIGrader:
         }
 
 
-    def _get_text_embedding(self, text: str) -> torch.Tensor:
-        """Generates BERT embeddings for text comparison."""
-        inputs = self.tokenizer(text, return_tensors="pt", padding=True, truncation=True)
-        with torch.no_grad():
-            outputs = self.model(**inputs)
-        return outputs.last_hidden_state.mean(dim=1)
+    def _get_requirement_embeddings(self, requirements: List[str]) -> torch.Tensor:
+        """
+        Returns embeddings for rubric requirements, reusing cached ones.
+        Rubrics are reused across submissions, so only unseen requirements
+        are embedded, all in a single batch.
+        """
+        if not requirements:
+            return torch.empty((0, self.model.config.hidden_size), device=self.device)
+
+        # Snapshot hits under the lock, then embed misses without holding it
+        with self._emb_cache_lock:
+            found = {r: self._emb_cache[r] for r in requirements if r in self._emb_cache}
+        missing = [r for r in dict.fromkeys(requirements) if r not in found]
+        if missing:
+            for req, emb in zip(missing, self._get_text_embeddings(missing)):
+                found[req] = emb.clone()
+
+        with self._emb_cache_lock:
+            for req in requirements:
+                self._emb_cache[req] = found[req]
+                self._emb_cache.move_to_end(req)
+
+            while len(self._emb_cache) > EMBEDDING_CACHE_SIZE:
+                self._emb_cache.popitem(last=False)
+
+        embeddings = [found[req] for req in requirements]
+        return torch.stack(embeddings)
 
-    def _calculate_similarity(self, emb1: torch.Tensor, emb2: torch.Tensor) -> float:
-        """Calculates semantic similarity between embeddings."""
-        similarity = torch.nn.functional.cosine_similarity(emb1, emb2)
-        return similarity.item()
+    def _get_assignment_embeddings(self, assignment_text: str) -> torch.Tensor:
+        """
+        Returns one embedding per overlapping window of the assignment, so
+        text past the model's input limit still counts. Windows are embedded
+        EMBED_BATCH_SIZE at a time, and only the first MAX_ASSIGNMENT_CHUNKS
+        windows are used.
+        """
+        key = hashlib.blake2b(assignment_text.encode('utf-8')).digest()
+        with self._emb_cache_lock:
+            cached = self._chunk_cache.get(key)
+            if cached is not None:
+                self._chunk_cache.move_to_end(key)
+                return cached
+
+        with self._tokenizer_lock:
+            inputs = self.tokenizer(
+                assignment_text[:MAX_ASSIGNMENT_CHARS], return_tensors="pt", padding='longest', truncation=True,
+                max_length=CHUNK_MAX_LENGTH, stride=CHUNK_STRIDE, return_overflowing_tokens=True
+            )
+        inputs.pop('overflow_to_sample_mapping', None)
+        window_count = min(inputs['input_ids'].shape[0], MAX_ASSIGNMENT_CHUNKS)
+        embeddings = torch.cat([
+            self._embed({
+                name: tensor[start:min(start + EMBED_BATCH_SIZE, window_count)].to(self.device)
+                for name, tensor in inputs.items()
+            })
+            for start in range(0, window_count, EMBED_BATCH_SIZE)
+        ])
+
+        with self._emb_cache_lock:
+            self._chunk_cache[key] = embeddings
+            while len(self._chunk_cache) > ASSIGNMENT_CACHE_SIZE:
+                self._chunk_cache.popitem(last=False)
+
+        return embeddings
+
+    def _get_text_embeddings(self, texts: List[str]) -> torch.Tensor:
+        """Generates BERT embeddings for a batch of texts, padded to the longest in each batch."""
+        if len(texts) > EMBED_BATCH_SIZE:
+            # Bucket similar lengths together so short texts aren't padded to long ones
+            order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+            embeddings = torch.empty(
+                (len(texts), self.model.config.hidden_size), device=self.device
+            )
+            for start in range(0, len(order), EMBED_BATCH_SIZE):
+                batch = order[start:start + EMBED_BATCH_SIZE]
+                embeddings[batch] = self._get_text_embeddings([texts[i] for i in batch])
+            return embeddings
+
+        with self._tokenizer_lock:
+            inputs = self.tokenizer(
+                texts, return_tensors="pt", padding='longest', truncation=True, max_length=MODEL_MAX_LENGTH
+            )
+        return self._embed(inputs.to(self.device))
+
+    def _embed(self, inputs) -> torch.Tensor:
+        """Runs the model on tokenized inputs and mean-pools each sequence."""
+        batch_size = inputs['input_ids'].shape[0]
+        if self._use_cuda_graphs and batch_size <= EMBED_BATCH_SIZE:
+            outputs = self._run_cuda_graph(inputs)
+        else:
+            with torch.inference_mode():
+                outputs = self.model(**inputs).last_hidden_state.float()
+
+        # Mean-pool over real tokens only so padding doesn't bias shorter texts
+        mask = inputs['attention_mask'].unsqueeze(-1).float()
+        return (outputs * mask).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+
+    def _run_cuda_graph(self, inputs) -> torch.Tensor:
+        """
+        Runs the forward pass by replaying a CUDA graph captured for the
+        input's (batch, length) bucket. Inputs are zero-padded into the
+        bucket's static buffers and the output is sliced back to size.
+        """
+        batch_size, seq_len = inputs['input_ids'].shape
+        bucket_batch = 1 << (batch_size - 1).bit_length()
+        bucket_seq = next(b for b in CUDA_GRAPH_SEQ_BUCKETS if b >= seq_len)
+
+        with self._cuda_graph_lock, torch.inference_mode():
+            graph, static_inputs, static_out = self._cuda_graphs[(bucket_batch, bucket_seq)]
+            for name, static in static_inputs.items():
+                static.zero_()
+                if name in inputs:
+                    static[:batch_size, :seq_len].copy_(inputs[name])
+            graph.replay()
+            return static_out[:batch_size, :seq_len].to(torch.float32, copy=True)
+
+    def _capture_cuda_graphs(self):
+        """
+        Captures a CUDA graph for every bucket shape. This runs before any
+        request is served, since capture fails if other threads launch GPU
+        work meanwhile. Replays are serialized by the lock, so all graphs
+        share one memory pool instead of each reserving its own.
+        """
+        pool = torch.cuda.graph_pool_handle()
+        batch_buckets = [1 << i for i in range((EMBED_BATCH_SIZE - 1).bit_length() + 1)]
+        with torch.inference_mode():
+            for batch_size in batch_buckets:
+                for seq_len in CUDA_GRAPH_SEQ_BUCKETS:
+                    self._cuda_graphs[(batch_size, seq_len)] = self._capture_cuda_graph(
+                        batch_size, seq_len, pool
+                    )
+
+    def _capture_cuda_graph(self, batch_size: int, seq_len: int, pool) -> tuple:
+        """Captures the model forward for one bucket shape into static buffers."""
+        static_inputs = {
+            name: torch.zeros((batch_size, seq_len), dtype=torch.long, device=self.device)
+            for name in ('input_ids', 'attention_mask', 'token_type_ids')
+        }
+
+        # Warm up on a side stream before capture, as required by CUDA graphs
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(3):
+                self.model(**static_inputs)
+        torch.cuda.current_stream().wait_stream(stream)
+
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph, pool=pool):
+            static_out = self.model(**static_inputs).last_hidden_state
+
+        return graph, static_inputs, static_out
 
     def _extract_points(self, section: str) -> int:
         """Extract point values from rubric text."""
-        point_patterns = [
-            r'(\d+)\s*points?',
-            r'(\d+)\s*marks?',
-            r'worth\s*(\d+)',
-            r'value:\s*(\d+)',
-            r'points:\s*(\d+)'
-        ]
-        
-        for pattern in point_patterns:
-            match = re.search(pattern, section, re.IGNORECASE)
+        for pattern in _POINT_RES:
+            match = pattern.search(section)
             if match:
                 return int(match.group(1))
         
@@ -120,73 +385,89 @@ class AIGrader:
 
     def _classify_requirement_type(self, requirement: str) -> str:
         """Classify the type of requirement."""
-        requirement_lower = requirement.lower()
-        
-        patterns = {
-            'analysis': ['analyze', 'examine', 'evaluate', 'assess'],
-            'implementation': ['implement', 'create', 'develop', 'build'],
-            'understanding': ['understand', 'explain', 'describe', 'discuss'],
-            'demonstration': ['demonstrate', 'show', 'display', 'present']
-        }
-        
-        for req_type, keywords in patterns.items():
-            if any(keyword in requirement_lower for keyword in keywords):
+        for req_type, pattern in _REQ_TYPE_RES:
+            if pattern.search(requirement):
                 return req_type
                 
         return 'general'
 
     def _extract_key_concepts(self, requirement: str) -> List[str]:
         """Extract key concepts and terms from requirement text."""
-        words = requirement.lower().split()
-        stop_words = {'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for', 'of'}
-        words = [word for word in words if word not in stop_words]
-        return [word for word in words if len(word) > 3]
+        # Short words cover the stop words (the, and, for, ...) as well
+        return [word for word in requirement.lower().split() if len(word) > 3]
 
     def _extract_requirements(self, section: str) -> List[str]:
         """Extract individual requirements from a section."""
         requirements = []
         
-        indicators = [
-            r'must\s+(.*?)[.]',
-            r'should\s+(.*?)[.]',
-            r'needs? to\s+(.*?)[.]',
-            r'required to\s+(.*?)[.]',
-            r'demonstrate\s+(.*?)[.]',
-            r'explain\s+(.*?)[.]',
-            r'analyze\s+(.*?)[.]',
-            r'discuss\s+(.*?)[.]'
-        ]
-        
-        for pattern in indicators:
-            matches = re.finditer(pattern, section, re.IGNORECASE)
-            for match in matches:
-                requirement = match.group(1).strip()
-                if requirement:
-                    requirements.append(requirement)
+        for match in _REQ_RE.finditer(section):
+            requirement = match.group(1).strip()
+            if requirement:
+                requirements.append(requirement)
         
         if not requirements and len(section.strip()) > 0:
             requirements.append(section.strip())
             
         return requirements
 
-    def _check_requirement_fulfillment(self, criterion: Dict, text: str, similarity: float) -> Dict:
+    def _find_keywords(self, criteria: List[Dict], text: str) -> Set[str]:
+        """
+        Returns the criteria keywords that occur anywhere in the text.
+        An Aho-Corasick automaton over all keywords scans the text once,
+        instead of one substring search per keyword per criterion.
+        """
+        keywords = {k.lower() for c in criteria for k in c['keywords']}
+        if not keywords:
+            return set()
+
+        automaton = ahocorasick.Automaton()
+        for keyword in keywords:
+            automaton.add_word(keyword, keyword)
+        automaton.make_automaton()
+
+        return {keyword for _, keyword in automaton.iter(text.lower())}
+
+    def _keyword_presence(self, criterion: Dict, found_keywords: Set[str]) -> float:
+        """Fraction of a criterion's keywords that appear in the assignment."""
+        keywords = criterion['keywords']
+        if not keywords:
+            return 0.0
+        return sum(1 for k in keywords if k.lower() in found_keywords) / len(keywords)
+
+    def _keyword_level(self, criterion: Dict, keyword_presence: float,
+                       short_assignment: bool) -> Optional[str]:
+        """
+        Returns the fulfillment level when keyword coverage alone is conclusive,
+        or None when semantic similarity is needed to decide.
+        """
+        if criterion['keywords'] and keyword_presence >= KEYWORD_MET_THRESHOLD:
+            return "Met"
+        if criterion['keywords'] and keyword_presence == 0 and short_assignment:
+            return "Not Met"
+        return None
+
+    def _check_requirement_fulfillment(self, criterion: Dict, keyword_presence: float,
+                                       similarity: Optional[float],
+                                       keyword_level: Optional[str] = None) -> Dict:
         """
         Checks how well a specific requirement is fulfilled in the assignment.
+        When keyword_level is set, keyword coverage alone decided the level
+        and no similarity was computed.
         """
-        if similarity > 0.85:
-            score = 1.0
-            level = "Met"
-        elif similarity > 0.65:
-            score = 0.5
-            level = "Partially Met"
+        if keyword_level is not None:
+            level = keyword_level
+            similarity = 1.0 if level == "Met" else 0.0
+            final_score = similarity
         else:
-            score = 0.0
-            level = "Not Met"
-
-        keyword_presence = sum(1 for k in criterion['keywords'] 
-                             if k.lower() in text.lower()) / len(criterion['keywords'])
-        
-        final_score = (similarity + keyword_presence) / 2
+            if similarity > SIMILARITY_MET_THRESHOLD:
+                level = "Met"
+            elif similarity > SIMILARITY_PARTIAL_THRESHOLD:
+                level = "Partially Met"
+            else:
+                level = "Not Met"
+            # Rescale so similarity at the Met threshold counts as full marks
+            semantic_score = min(max(similarity / SIMILARITY_MET_THRESHOLD, 0.0), 1.0)
+            final_score = (semantic_score + keyword_presence) / 2
         
         feedback, suggestions = self._generate_criterion_feedback(
             criterion, level, similarity, keyword_presence